@@ -0,0 +1,325 @@
+"""
+单进程本地运行 user/product/order 三个服务
+
+学习要点：
+1. 不需要 PostgreSQL / RabbitMQ：数据库使用 SQLite，消息使用进程内队列（BROKER_URL=memory://）
+2. 服务间 HTTP 调用通过 httpx.ASGITransport 直接进入目标应用，不经过网络
+3. 整条事件链路（下单 -> 发布事件 -> 扣减库存）在一个进程中完成，便于性能分析和压测
+4. --startup 在独立进程中分别启动每个服务，测量冷启动（导入耗时、就绪耗时）
+5. --signups 只启动 user-service，压测注册（Argon2id 哈希），输出每核每秒注册数
+
+用法：
+    python scripts/local_stack.py --orders 2000 --concurrency 50
+    python scripts/local_stack.py --startup
+    python scripts/local_stack.py --signups 500 --concurrency 50 --hash-workers 2
+    python -m cProfile -o orders.prof scripts/local_stack.py --orders 500
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+
+import httpx
+from prometheus_client import REGISTRY
+from sqlalchemy import func
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+SERVICE_NAMES = ("user", "product", "order")
+BROKER_URL = "memory://local"
+LOCAL_SAMPLE_RATES = "order.published=0.01,reservation.confirmed=0.01,stock.deducted=0.01,stock.failed=0.01"
+
+
+def load_service(name, env):
+    """以独立模块名加载 services/<name>-service/main.py，导入期间使用该服务自己的环境变量"""
+    service_dir = SERVICES_DIR / f"{name}-service"
+    # 共享的 database.py / messaging.py 在各服务中完全一致，加载哪一份都可以
+    if str(service_dir) not in sys.path:
+        sys.path.append(str(service_dir))
+
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{name}_service_main", service_dir / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module
+
+
+def service_env(name, workdir, database_url=None):
+    return {
+        "DATABASE_URL": database_url or f"sqlite:///{Path(workdir) / f'{name}.db'}",
+        "BROKER_URL": BROKER_URL,
+        "OTEL_SERVICE_NAME": f"{name}-service",
+        "OTEL_TRACES_EXPORTER": os.getenv("OTEL_TRACES_EXPORTER", "none"),
+        "SERVER_TIMING": "true",
+        # 每条消息一条的日志只保留 1%（JSON 日志，见 logging_config.py）
+        "LOG_SAMPLE_RATES": os.getenv("LOG_SAMPLE_RATES", LOCAL_SAMPLE_RATES),
+        "USER_SERVICE_URL": "http://user-service",
+        "PRODUCT_SERVICE_URL": "http://product-service",
+    }
+
+
+def load_services(workdir, database_urls=None):
+    """加载三个服务，默认每个服务使用 workdir 下独立的 SQLite 数据库"""
+    database_urls = database_urls or {}
+    return {name: load_service(name, service_env(name, workdir, database_urls.get(name))) for name in SERVICE_NAMES}
+
+
+def asgi_client(app, base_url):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=base_url, timeout=30.0)
+
+
+@asynccontextmanager
+async def running_stack(workdir, database_urls=None):
+    """启动三个服务（执行各自的 lifespan），退出时按相反顺序关闭"""
+    services = load_services(workdir, database_urls)
+
+    # order-service 的下游调用直接路由到同进程内的应用
+    services["order"].http_client = httpx.AsyncClient(timeout=5.0, mounts={
+        "http://user-service": httpx.ASGITransport(app=services["user"].app),
+        "http://product-service": httpx.ASGITransport(app=services["product"].app),
+    })
+
+    async with AsyncExitStack() as stack:
+        for module in services.values():
+            await stack.enter_async_context(module.app.router.lifespan_context(module.app))
+        # lifespan 只是启动后台初始化，等待所有服务就绪（/ready 返回 200）
+        await asyncio.gather(*(module.startup.wait() for module in services.values()))
+        yield services
+
+
+def stage_breakdown():
+    """从 stage_duration_seconds 汇总每个阶段的平均耗时"""
+    sums, counts = {}, {}
+    for metric in REGISTRY.collect():
+        if metric.name != "stage_duration_seconds":
+            continue
+        for sample in metric.samples:
+            key = (sample.labels.get("operation"), sample.labels.get("stage"))
+            if sample.name.endswith("_sum"):
+                sums[key] = sample.value
+            elif sample.name.endswith("_count"):
+                counts[key] = sample.value
+    return {key: (counts[key], sums[key] / counts[key]) for key in sorted(counts) if counts[key]}
+
+
+def coalescing():
+    """从 singleflight_calls_total 汇总每组读取的合并情况：{(service, group): (follower, 全部调用)}"""
+    calls = {}
+    for metric in REGISTRY.collect():
+        if metric.name != "singleflight_calls":
+            continue
+        for sample in metric.samples:
+            if not sample.name.endswith("_total"):
+                continue
+            key = (sample.labels["service"], sample.labels["group"])
+            followers, total = calls.get(key, (0, 0))
+            if sample.labels["role"] == "follower":
+                followers += sample.value
+            calls[key] = (followers, total + sample.value)
+    return {key: calls[key] for key in sorted(calls) if calls[key][1]}
+
+
+def log_volume():
+    """从 log_records_total 汇总日志量：{outcome: 条数}"""
+    volume = {}
+    for metric in REGISTRY.collect():
+        if metric.name != "log_records":
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith("_total"):
+                outcome = sample.labels["outcome"]
+                volume[outcome] = volume.get(outcome, 0) + int(sample.value)
+    return volume
+
+
+def order_statuses(module):
+    """按状态统计订单数量（库存结果事件全部处理后应没有 created）"""
+    db = module.SessionLocal()
+    try:
+        return dict(db.query(module.Order.status, func.count()).group_by(module.Order.status).all())
+    finally:
+        db.close()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def bench_orders(orders, concurrency, workdir, stock=None):
+    async with running_stack(workdir) as services:
+        users = asgi_client(services["user"].app, "http://user-service")
+        products = asgi_client(services["product"].app, "http://product-service")
+        order_api = asgi_client(services["order"].app, "http://order-service")
+
+        async with users, products, order_api:
+            user = (await users.post("/api/users", json={
+                "email": f"bench-{time.time_ns()}@example.com", "name": "bench", "password": "bench",
+            })).json()
+            product = (await products.post("/api/products/", json={
+                "name": "bench", "description": "bench", "price": 1.0, "stock": orders if stock is None else stock,
+            })).json()
+
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+            failures = {}
+
+            async def place_order():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await order_api.post("/api/orders", json={
+                        "user_id": user["id"], "product_id": product["id"], "quantity": 1,
+                    })
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        failures[response.status_code] = failures.get(response.status_code, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(place_order() for _ in range(orders)))
+            elapsed = time.perf_counter() - started
+
+            # 等待 product-service 消费完所有订单事件
+            await services["order"].broker.join()
+            drained = time.perf_counter() - started
+
+            remaining = (await products.get(f"/api/products/{product['id']}")).json()["stock"]
+            statuses = order_statuses(services["order"])
+
+    for name, module in services.items():
+        print(f"startup {name + ':':<8} import {module.startup.import_seconds:.3f} s, "
+              f"ready {module.startup.ready_seconds:.3f} s")
+    by_status = f" {failures}" if failures else ""
+    print(f"orders:          {orders} (concurrency {concurrency}, failures {sum(failures.values())}{by_status})")
+    print(f"throughput:      {orders / elapsed:.1f} orders/s")
+    print(f"latency p50:     {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"latency p99:     {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"events drained:  {drained:.2f} s (remaining stock {remaining})")
+    print(f"order statuses:  {statuses}")
+    for (operation, stage), (count, mean) in stage_breakdown().items():
+        print(f"stage {operation}/{stage}: {mean * 1000:.2f} ms avg ({int(count)} samples)")
+    for (service, group), (followers, total) in coalescing().items():
+        print(f"coalesced {service}/{group}: {int(followers)}/{int(total)} ({followers / total:.0%})")
+    print(f"log records:     {log_volume()}")
+
+
+async def bench_signups(signups, concurrency, workdir, hash_workers=None):
+    """
+    只启动 user-service 并发注册 signups 个用户，每 10 个注册中有 1 个使用已存在的邮箱
+
+    每核吞吐 = 注册数 / 进程消耗的 CPU 秒数：与机器核数、PASSWORD_HASH_WORKERS 无关，
+    用于比较不同的哈希成本参数；乘以 Pod 的 CPU limit 即单个副本的注册容量
+    """
+    env = service_env("user", workdir)
+    if hash_workers:
+        env["PASSWORD_HASH_WORKERS"] = str(hash_workers)
+    module = load_service("user", env)
+    async with module.app.router.lifespan_context(module.app):
+        await module.startup.wait()
+        async with asgi_client(module.app, "http://user-service") as users:
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+            statuses = {}
+
+            async def sign_up(i):
+                # 重复的邮箱只有大小写不同，由 lower(email) 唯一索引拒绝
+                email = f"Signup-{i - 1}@Example.com" if i % 10 == 9 else f"signup-{i}@example.com"
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await users.post("/api/users", json={
+                        "email": email, "name": f"signup {i}", "password": f"password-{i}",
+                    })
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            cpu_started = time.process_time()
+            started = time.perf_counter()
+            await asyncio.gather(*(sign_up(i) for i in range(signups)))
+            elapsed = time.perf_counter() - started
+            cpu_seconds = time.process_time() - cpu_started
+
+    hash_seconds = REGISTRY.get_sample_value(
+        "password_hash_seconds_sum", {"service": "user-service", "operation": "hash"})
+    print(f"signups:         {signups} (concurrency {concurrency}, responses {dict(sorted(statuses.items()))})")
+    print(f"hash workers:    {module.passwords.workers}")
+    print(f"throughput:      {signups / elapsed:.1f} signups/s")
+    print(f"cpu:             {cpu_seconds:.2f} s ({cpu_seconds / elapsed:.2f} cores busy)")
+    print(f"per core:        {signups / cpu_seconds:.1f} signups/s per core")
+    print(f"hash cpu avg:    {hash_seconds / signups * 1000:.2f} ms")
+    print(f"latency p50:     {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"latency p99:     {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"event loop lag:  {module.loop_lag.max_lag * 1000:.2f} ms max")
+
+
+async def measure_startup(name, workdir):
+    """在当前（全新）进程中启动单个服务，输出冷启动耗时"""
+    module = load_service(name, service_env(name, workdir))
+    async with module.app.router.lifespan_context(module.app):
+        await module.startup.wait()
+    print(json.dumps({
+        "service": name,
+        "import_seconds": module.startup.import_seconds,
+        "ready_seconds": module.startup.ready_seconds,
+    }))
+
+
+def bench_startup(workdir, runs):
+    """每个服务在独立进程中启动 runs 次，取中位数（同一进程内后启动的服务会复用已导入的依赖）"""
+    for name in SERVICE_NAMES:
+        results = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure-startup", name, "--workdir", workdir],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        import_seconds = statistics.median(r["import_seconds"] for r in results)
+        ready_seconds = statistics.median(r["ready_seconds"] for r in results)
+        print(f"cold start {name + ':':<8} import {import_seconds:.3f} s, ready {ready_seconds:.3f} s "
+              f"(median of {runs})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单进程运行全部服务并压测下单链路")
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stock", type=int, help="商品初始库存（默认等于 --orders，小于时可验证不会超卖）")
+    parser.add_argument("--startup", action="store_true", help="测量每个服务的冷启动耗时")
+    parser.add_argument("--runs", type=int, default=5, help="--startup 的重复次数")
+    parser.add_argument("--signups", type=int, help="只压测 user-service 注册（密码哈希）")
+    parser.add_argument("--hash-workers", type=int, help="--signups 的 PASSWORD_HASH_WORKERS（默认可用 CPU 数）")
+    parser.add_argument("--measure-startup", metavar="SERVICE", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_startup:
+        asyncio.run(measure_startup(args.measure_startup, args.workdir))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.startup:
+            bench_startup(workdir, args.runs)
+        elif args.signups:
+            asyncio.run(bench_signups(args.signups, args.concurrency, workdir, args.hash_workers))
+        else:
+            asyncio.run(bench_orders(args.orders, args.concurrency, workdir, args.stock))
+
+
+if __name__ == "__main__":
+    main()
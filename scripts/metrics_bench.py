@@ -0,0 +1,143 @@
+"""
+指标更新微基准 - 每个请求在 Prometheus 计数上花费的时间
+
+学习要点：
+1. 模拟 POST /api/orders 一次请求的指标更新：两次下游调用计数、一次发布计数、服务自己的请求计数，
+   中间件的请求计数和耗时 Histogram，以及 StageTimer 记录的各阶段耗时（stage_duration_seconds）
+2. 三种写法对比：
+   - labels(**kwargs)：原来的写法，每次校验 label 名、构造元组、获取指标锁
+   - 预绑定（BoundMetric）：导入时创建子序列，热路径上只剩一次字典查找
+   - 线程本地（METRICS_THREAD_LOCAL=true）：Counter 的 inc() 不加锁，抓取时 flush
+3. --threads > 1 时多个线程同时更新同一批指标（事件循环 + 消费者线程），观察锁竞争
+
+用法：
+    python scripts/metrics_bench.py
+    python scripts/metrics_bench.py --requests 200000 --threads 2
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "services" / "order-service"))
+from bound_metrics import BoundMetric, flush  # noqa: E402
+
+ENDPOINT = "/api/orders"
+# create_order 的阶段（timing.py 的 kind, stage）
+STAGES = [
+    ("downstream", "call_user_service"),
+    ("downstream", "reserve_stock"),
+    ("db", "db.commit"),
+    ("serialization", "event.encode"),
+    ("broker", "broker.publish"),
+]
+# 每个请求的指标更新次数
+UPDATES = 6 + len(STAGES)
+
+
+def create_metrics():
+    """与 order-service 同名同 label 的指标，注册在独立的 registry 中"""
+    registry = CollectorRegistry()
+    return {
+        "requests": Counter('order_service_http_requests_total', 'requests',
+                            ['method', 'endpoint', 'status'], registry=registry),
+        "calls": Counter('service_calls_total', 'calls', ['target_service', 'status'], registry=registry),
+        "published": Counter('rabbitmq_messages_published_total', 'published',
+                             ['exchange', 'routing_key'], registry=registry),
+        "http": Counter('http_requests_total', 'http', ['service', 'method', 'endpoint', 'status'], registry=registry),
+        "duration": Histogram('http_request_duration_seconds', 'duration',
+                              ['service', 'method', 'endpoint'], registry=registry),
+        "stages": Histogram('stage_duration_seconds', 'stages',
+                            ['service', 'operation', 'kind', 'stage'], registry=registry),
+    }, registry
+
+
+def kwargs_request(metrics):
+    """原来的写法"""
+    calls, published, requests = metrics["calls"], metrics["published"], metrics["requests"]
+    http, duration, stages = metrics["http"], metrics["duration"], metrics["stages"]
+
+    def request():
+        calls.labels(target_service="user-service", status="200").inc()
+        calls.labels(target_service="product-service", status="201").inc()
+        published.labels(exchange="order_events", routing_key="order.created").inc()
+        requests.labels(method="POST", endpoint=ENDPOINT, status="200").inc()
+        http.labels(service="order-service", method="POST", endpoint=ENDPOINT, status="200").inc()
+        duration.labels(service="order-service", method="POST", endpoint=ENDPOINT).observe(0.01)
+        for kind, stage in STAGES:
+            stages.labels(service="order-service", operation="create_order", kind=kind, stage=stage).observe(0.001)
+    return request
+
+
+def bound_request(metrics, thread_local):
+    """BoundMetric 写法（与服务中的调用方式相同）"""
+    calls = BoundMetric(metrics["calls"], [("user-service", "200"), ("product-service", "201")], thread_local)
+    published = BoundMetric(metrics["published"], [("order_events", "order.created")], thread_local)
+    requests = BoundMetric(metrics["requests"], [("POST", ENDPOINT, "200")], thread_local)
+    http = BoundMetric(metrics["http"], thread_local=thread_local)
+    duration = BoundMetric(metrics["duration"])
+    stages = BoundMetric(metrics["stages"])
+
+    def request():
+        calls.labels("user-service", "200").inc()
+        calls.labels("product-service", "201").inc()
+        published.labels("order_events", "order.created").inc()
+        requests.labels("POST", ENDPOINT, "200").inc()
+        http.labels("order-service", "POST", ENDPOINT, "200").inc()
+        duration.labels("order-service", "POST", ENDPOINT).observe(0.01)
+        for kind, stage in STAGES:
+            stages.labels("order-service", "create_order", kind, stage).observe(0.001)
+    return request
+
+
+def run(request, requests, threads):
+    """threads 个线程各执行 requests / threads 次，返回每个请求的平均耗时（秒，墙钟时间）"""
+    per_thread = requests // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            request()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / (per_thread * threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较每个请求的 Prometheus 指标更新开销")
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=1, help="同时更新指标的线程数")
+    args = parser.parse_args()
+
+    variants = [
+        ("labels(**kwargs)", lambda metrics: kwargs_request(metrics)),
+        ("pre-bound", lambda metrics: bound_request(metrics, thread_local=False)),
+        ("thread-local", lambda metrics: bound_request(metrics, thread_local=True)),
+    ]
+    baseline = None
+    for name, make in variants:
+        metrics, registry = create_metrics()
+        request = make(metrics)
+        run(request, min(args.requests, 10000), 1)  # 预热
+        seconds = run(request, args.requests, args.threads)
+        flush()
+        # 校验：所有写法最终导出的计数相同（预热 + 正式运行）
+        total = registry.get_sample_value(
+            "order_service_http_requests_total", {"method": "POST", "endpoint": ENDPOINT, "status": "200"})
+        baseline = baseline or seconds
+        print(f"{name + ':':<18} {seconds * 1e6:6.2f} us/request ({seconds / UPDATES * 1e9:5.0f} ns/update, "
+              f"{baseline / seconds:4.1f}x, {args.threads} threads, counted {int(total)})")
+
+
+if __name__ == "__main__":
+    main()
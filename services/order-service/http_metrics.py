@@ -0,0 +1,103 @@
+"""
+HTTP 指标 - 自动扩缩容和告警规则使用的统一名称
+
+学习要点：
+1. 指标名称与 k8s/autoscaling（Prometheus Adapter、KEDA）和 k8s/monitoring（告警规则）一致：
+   - http_requests_total{service, method, endpoint, status}
+   - http_request_duration_seconds{service, method, endpoint}（Histogram）
+   - http_requests_in_flight{service}：正在处理的请求数，比 CPU 更直接地反映负载
+2. endpoint 使用路由模板（/api/orders/{order_id}），而不是实际路径，避免标签基数爆炸
+3. 纯 ASGI 中间件：流式响应在响应结束时才算完成
+   - SSE、长轮询大部分时间在等待事件，不计入 http_requests_in_flight 和耗时（否则挂起的连接
+     会触发 HPA 扩容和 HighLatency 告警），改为计入 http_streaming_requests_in_flight{service}
+4. 每个请求都要更新计数：子序列按 label 值缓存（bound_metrics.py），不再每次调用 labels()
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import time
+from urllib.parse import parse_qs
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.routing import Match
+
+from bound_metrics import BoundMetric
+
+http_requests_total = Counter(
+    'http_requests_total',
+    'Total HTTP requests',
+    ['service', 'method', 'endpoint', 'status']
+)
+
+http_request_duration_seconds = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request duration in seconds',
+    ['service', 'method', 'endpoint'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests currently being served',
+    ['service']
+)
+
+http_streaming_requests_in_flight = Gauge(
+    'http_streaming_requests_in_flight',
+    'Long-poll and SSE requests currently open (not counted in http_requests_in_flight)',
+    ['service']
+)
+
+
+def route_template(scope):
+    """匹配到的路由模板，未匹配的请求（404）统一记为 unmatched"""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class HTTPMetricsMiddleware:
+    """
+    记录请求数、耗时和正在处理的请求数
+
+    streaming(endpoint, query) 返回 True 的请求（SSE、长轮询）只计入请求数和
+    http_streaming_requests_in_flight；query 是 parse_qs 解析后的查询参数
+    """
+
+    def __init__(self, app, service, streaming=None):
+        self.app = app
+        self.service = service
+        self.streaming = streaming
+        self.in_flight = http_requests_in_flight.labels(service=service)
+        self.streams = http_streaming_requests_in_flight.labels(service=service)
+        self.requests = BoundMetric(http_requests_total)
+        self.durations = BoundMetric(http_request_duration_seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = route_template(scope)
+        streaming = self.streaming is not None and self.streaming(
+            endpoint, parse_qs(scope["query_string"].decode("latin-1"))
+        )
+        in_flight = self.streams if streaming else self.in_flight
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            self.requests.labels(self.service, scope["method"], endpoint, status).inc()
+            if not streaming:
+                self.durations.labels(self.service, scope["method"], endpoint).observe(time.perf_counter() - started)
@@ -0,0 +1,755 @@
+"""
+消息代理抽象 - RabbitMQ / 进程内 asyncio 队列
+
+学习要点：
+1. 通过 BROKER_URL 选择实现：amqp:// 使用 RabbitMQ，memory:// 使用进程内队列
+2. 进程内实现不依赖外部基础设施，多个服务可以在同一进程中运行（性能分析、基准测试）
+3. 消费者只关心消息体和消息头，ack/nack 由代理实现负责
+4. 批量消费：攒够一批（或等待超时）后一次交给处理函数，处理函数可以用一条 SQL 处理整批消息
+5. 有界重试：失败次数记录在消息头中，按指数退避延迟重投，超过上限进入死信队列
+   - 不再无限 nack + requeue：一条格式错误的消息不会占满 CPU、堵住整个队列
+6. 竞争消费者：持久化的命名队列由所有副本共享，每个副本可以开多个消费者
+   - 可选按 routing key（如 product_id）一致性哈希分片，每个分片同一时刻只有一个活跃消费者，
+     同一商品的事件保持顺序
+   - 分片按 shard % CONSUMER_COUNT 分给本进程的各个消费者连接：一个分片在每个副本中只有一个消费者，
+     各分片由不同的线程处理；其他副本上同一分片的消费者是备用的，活跃消费者断开后接手
+   - 队列积压（ready 消息数）导出为指标，KEDA 据此扩缩容
+7. 扩缩容信号：处理速率、消费者忙碌时间（忙碌时间 / 墙钟时间 = 饱和度）、未确认的发布数
+   - 发布使用 publisher confirms：basic_publish 返回时 RabbitMQ 已经接收消息
+
+注意：本文件在 order-service 和 product-service 中保持完全一致。
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import zlib
+
+import pika
+from prometheus_client import Counter, Gauge
+
+from bound_metrics import BoundMetric
+
+logger = logging.getLogger(__name__)
+
+# 已失败的次数（消息头），每次重投加 1
+ATTEMPTS_HEADER = "x-attempts"
+# 最后一次失败的异常，进入死信队列后便于排查
+ERROR_HEADER = "x-last-error"
+
+# 队列深度（积压、死信）的刷新间隔（秒）
+QUEUE_DEPTH_INTERVAL = 15
+
+# 消费者连接断开后的重连延迟（秒）：每次失败翻倍，最多 RECONNECT_MAX_DELAY
+RECONNECT_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+messages_redelivered_total = Counter(
+    'messages_redelivered_total',
+    'Messages scheduled for delayed redelivery after a handler failure',
+    ['queue']
+)
+
+messages_dead_lettered_total = Counter(
+    'messages_dead_lettered_total',
+    'Messages moved to the dead-letter queue',
+    ['queue']
+)
+
+dead_letter_queue_messages = Gauge(
+    'dead_letter_queue_messages',
+    'Messages waiting in the dead-letter queue',
+    ['queue']
+)
+
+message_queue_backlog = Gauge(
+    'message_queue_backlog',
+    'Messages ready for delivery in a work queue (not yet delivered to a consumer)',
+    ['queue']
+)
+
+message_queue_consumers = Gauge(
+    'message_queue_consumers',
+    'Consumers attached to a work queue',
+    ['queue']
+)
+
+# 每批消息都要更新：子序列按 label 值缓存（bound_metrics.py）
+messages_processed_total = BoundMetric(Counter(
+    'messages_processed_total',
+    'Messages handled by consumers in this process',
+    ['queue', 'result']
+))
+
+consumer_busy_seconds_total = BoundMetric(Counter(
+    'consumer_busy_seconds_total',
+    'Time consumers in this process spent inside message handlers',
+    ['queue']
+))
+
+consumer_workers = Gauge(
+    'consumer_workers',
+    'Consumers running in this process (saturation = rate(consumer_busy_seconds_total) / consumer_workers)',
+    ['queue']
+)
+
+message_publishes_unconfirmed = Gauge(
+    'message_publishes_unconfirmed',
+    'Publishes waiting for the publish lock or a broker confirm',
+    ['exchange']
+)
+
+
+class RejectMessage(Exception):
+    """处理函数抛出此异常表示消息永远无法处理（格式错误等），不重试，直接进入死信队列"""
+
+
+class PublishUncertain(Exception):
+    """
+    发布结果未知：消息已经发出，但没有收到确认（发送后连接断开等）
+
+    消息可能已经到达 RabbitMQ 并被消费，调用方不能按“没有发出”做补偿。
+    其他异常表示消息确定没有进入 RabbitMQ（连接失败、被拒绝）。
+    """
+
+
+class MessageBroker:
+    """消息代理接口"""
+
+    def __init__(self, max_attempts=5, retry_delay=1.0, consumer_count=1, prefetch=10):
+        # 第 n 次失败后延迟 retry_delay * 2^(n-1) 秒重投，失败 max_attempts 次后进入死信队列
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # 每个命名队列在本进程中的并发消费者数，以及每个消费者最多持有的未确认消息数
+        self.consumer_count = consumer_count
+        self.prefetch = prefetch
+
+    def publish(self, exchange, body, headers=None, routing_key=""):
+        """发布消息到 Exchange，routing_key 决定分片队列（见 subscribe 的 shards）"""
+        raise NotImplementedError
+
+    def subscribe(self, exchange, handler, queue="", shards=0):
+        """
+        注册消费者，需要在 start() 之前调用
+
+        handler(body: bytes, headers: dict) 抛出异常时消息延迟重投，多次失败后进入死信队列。
+        queue 是持久化的共享队列，多个副本竞争消费；为空时使用独占的自动命名队列
+        （fanout 广播语义，失败时直接重新入队，没有重试和死信）。
+        shards > 0 时按消息的 routing key 一致性哈希到 <queue>.shard-<n>，
+        每个分片同一时刻只有一个活跃消费者，同一 routing key 的消息按顺序处理。
+        """
+        raise NotImplementedError
+
+    def subscribe_batch(self, exchange, handler, queue="", batch_size=100, batch_wait=0.05):
+        """
+        注册批量消费者，需要在 start() 之前调用
+
+        handler(messages: list[(body, headers)]) 在攒够 batch_size 条或第一条消息等待
+        batch_wait 秒后调用。handler 需要在一个事务中处理整批：抛出异常时逐条重新处理，
+        只有真正失败的消息进入重试和死信流程。
+        """
+        raise NotImplementedError
+
+    async def start(self):
+        """启动已注册的消费者（建立连接的阻塞操作不在事件循环中执行）"""
+        raise NotImplementedError
+
+    def close(self):
+        """关闭连接并停止消费者"""
+        raise NotImplementedError
+
+    def retry_delays(self):
+        """每次重投前的延迟（秒），长度为 max_attempts - 1"""
+        return [self.retry_delay * 2 ** attempt for attempt in range(self.max_attempts - 1)]
+
+    def _failed(self, queue, headers, error):
+        """
+        消息处理失败后的去向
+
+        返回 (新的消息头, 重投前的延迟)，延迟为 None 表示进入死信队列
+        """
+        attempts = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+        headers = {**headers, ATTEMPTS_HEADER: attempts, ERROR_HEADER: f"{type(error).__name__}: {error}"[:500]}
+        if isinstance(error, RejectMessage) or attempts >= self.max_attempts:
+            messages_dead_lettered_total.labels(queue=queue).inc()
+            logger.warning("消息进入死信队列 %s.dlq（失败 %d 次）: %s", queue, attempts, error, extra={
+                "event": "message.dead_lettered", "queue": queue, "attempts": attempts,
+            })
+            return headers, None
+        messages_redelivered_total.labels(queue=queue).inc()
+        return headers, self.retry_delays()[attempts - 1]
+
+    def _process(self, queue, handler, batched, items):
+        """处理消息并记录处理数量和忙碌时间，返回失败的 [(item, error)]"""
+        queue = queue or "exclusive"
+        started = time.perf_counter()
+        failures = self._dispatch(handler, batched, items)
+        consumer_busy_seconds_total.labels(queue).inc(time.perf_counter() - started)
+        if len(items) > len(failures):
+            messages_processed_total.labels(queue, "ok").inc(len(items) - len(failures))
+        if failures:
+            messages_processed_total.labels(queue, "error").inc(len(failures))
+        return failures
+
+    @staticmethod
+    def _dispatch(handler, batched, items):
+        """
+        调用处理函数，返回失败的 [(item, error)]
+
+        items 是 [(token, body, headers)]。批量处理失败时逐条重新处理，
+        避免一条有问题的消息拖累整批。
+        """
+        if not batched:
+            _, body, headers = items[0]
+            try:
+                handler(body, headers)
+            except Exception as e:
+                return [(items[0], e)]
+            return []
+        try:
+            handler([(body, headers) for _, body, headers in items])
+            return []
+        except Exception as e:
+            if len(items) == 1:
+                return [(items[0], e)]
+        failures = []
+        for item in items:
+            try:
+                handler([(item[1], item[2])])
+            except Exception as e:
+                failures.append((item, e))
+        return failures
+
+
+class RabbitMQBroker(MessageBroker):
+    """
+    基于 pika 的 RabbitMQ 实现
+
+    每个命名队列 <queue> 附带：
+    - <queue>.retry.<ms>ms：每级延迟一个队列，消息 TTL 到期后通过默认 Exchange 回到 <queue>
+      （每个队列只有一种 TTL，不会出现队头消息阻塞后面已到期消息的问题）
+    - <queue>.dlx（fanout Exchange）→ <queue>.dlq：失败次数达到上限的消息
+
+    分片时 <queue>.shards（x-consistent-hash Exchange，需要 rabbitmq_consistent_hash_exchange 插件）
+    绑定到原 Exchange，再按 routing key 分发到 <queue>.shard-<n>（x-single-active-consumer）。
+    每个消费者使用独立的连接和线程（BlockingConnection 不是线程安全的），
+    连接断开后在同一线程中按指数退避重连并重新订阅。
+    """
+
+    def __init__(self, url, exchange_type="fanout", **options):
+        super().__init__(**options)
+        self.url = url
+        self.exchange_type = exchange_type
+        self._subscriptions = []
+        self._publish_lock = threading.Lock()
+        self._publish_connection = None
+        self._publish_channel = None
+        self._declared_exchanges = set()
+        # 消费者连接序号 -> 当前连接（重连后替换）
+        self._consumer_connections = {}
+        self._consumer_threads = []
+        self._consumers = []
+        self._stopping = threading.Event()
+        self._depth_channel = None
+        self._named_queues = []
+
+    def _connect(self):
+        return pika.BlockingConnection(pika.URLParameters(self.url))
+
+    def _get_publish_channel(self):
+        # 为什么复用连接？
+        # 每条消息新建一次 TCP + AMQP 握手，在高并发下比发布本身慢得多
+        if self._publish_connection is None or self._publish_connection.is_closed:
+            self._publish_connection = self._connect()
+            self._publish_channel = self._publish_connection.channel()
+            # publisher confirms：basic_publish 等待 RabbitMQ 确认，被拒绝时抛出 NackError
+            self._publish_channel.confirm_delivery()
+            self._declared_exchanges.clear()
+        return self._publish_channel
+
+    def publish(self, exchange, body, headers=None, routing_key=""):
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # 消息持久化
+            headers=headers or None,
+        )
+        unconfirmed = message_publishes_unconfirmed.labels(exchange=exchange)
+        unconfirmed.inc()
+        # 已经调用过 basic_publish 但没有得到明确结果（确认或拒绝）
+        maybe_sent = False
+        try:
+            with self._publish_lock:
+                # 连接可能在空闲期间被服务端关闭，失败时重连一次
+                for attempt in range(2):
+                    try:
+                        channel = self._get_publish_channel()
+                        if exchange not in self._declared_exchanges:
+                            channel.exchange_declare(exchange=exchange, exchange_type=self.exchange_type, durable=True)
+                            self._declared_exchanges.add(exchange)
+                        try:
+                            channel.basic_publish(
+                                exchange=exchange,
+                                # fanout exchange 本身忽略 routing_key，分片的一致性哈希 Exchange 使用它
+                                routing_key=routing_key,
+                                body=body,
+                                properties=properties,
+                            )
+                        except pika.exceptions.NackError:
+                            # RabbitMQ 明确拒绝了消息
+                            raise
+                        except pika.exceptions.AMQPError:
+                            maybe_sent = True
+                            raise
+                        return
+                    except pika.exceptions.AMQPError as e:
+                        self._drop_publish_connection()
+                        if attempt:
+                            if maybe_sent:
+                                raise PublishUncertain(f"{type(e).__name__}: {e}") from e
+                            raise
+        finally:
+            unconfirmed.dec()
+
+    def _drop_publish_connection(self):
+        # channel 级别的错误（NackError、声明参数冲突）不会断开 TCP 连接：先关闭再丢弃，否则每次失败泄漏一个连接
+        connection, self._publish_connection, self._publish_channel = self._publish_connection, None, None
+        if connection is not None and not connection.is_closed:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def subscribe(self, exchange, handler, queue="", shards=0):
+        self._subscriptions.append((exchange, handler, queue, shards, None))
+
+    def subscribe_batch(self, exchange, handler, queue="", batch_size=100, batch_wait=0.05):
+        self._subscriptions.append((exchange, handler, queue, 0, (batch_size, batch_wait)))
+
+    async def start(self):
+        if self._subscriptions:
+            await asyncio.to_thread(self._start_consuming)
+
+    def _start_consuming(self):
+        # 第一次连接在 start() 中完成：RabbitMQ 不可用时启动失败并由 startup.py 重试，而不是在后台静默重连
+        opened = []
+        try:
+            for index in range(self.consumer_count):
+                opened.append(self._open_consumer(index))
+        except Exception:
+            for connection, _, counted in filter(None, opened):
+                self._close_consumer(connection, counted)
+            raise
+
+        # pika 是同步库，每个连接在独立线程中运行，断开后在同一线程中重连
+        for index, consumer in enumerate(opened):
+            if consumer is None:
+                continue
+            thread = threading.Thread(target=self._run_consumer, args=(index, *consumer), daemon=True)
+            self._consumer_threads.append(thread)
+            thread.start()
+
+    def _open_consumer(self, index):
+        """
+        建立第 index 个消费者连接并订阅分配给它的队列
+
+        返回 (连接, channel, 已计入 consumer_workers 的子序列)；没有要消费的队列时返回 None
+        """
+        connection = self._connect()
+        counted = []
+        try:
+            channel = connection.channel()
+            if index == 0:
+                # 独占队列随声明它的连接删除，第 0 个连接每次（重新）连接都重新声明拓扑
+                self._consumers = self._declare_topology(channel)
+            # 独占队列只能被声明它的连接消费，分片只由 shard % consumer_count 号连接消费
+            assigned = [consumer for consumer in self._consumers if consumer[4] in (None, index)]
+            if not assigned:
+                # 分片数少于 consumer_count：多出的连接没有要消费的队列
+                connection.close()
+                return None
+            for queue_name, handler, retry_queue, batch, _, single_active in assigned:
+                self._consume(channel, queue_name, handler, retry_queue, batch, single_active, counted)
+            if index == 0 and self._named_queues:
+                self._depth_channel = channel
+                self._refresh_queue_depths()
+        except Exception:
+            self._close_consumer(connection, counted)
+            raise
+        self._consumer_connections[index] = connection
+        return connection, channel, counted
+
+    @staticmethod
+    def _close_consumer(connection, counted):
+        # 断开的消费者不再计入 consumer_workers（未确认的消息由 RabbitMQ 重新投递给其他消费者）
+        for workers in counted:
+            workers.dec()
+        counted.clear()
+        if connection.is_open:
+            connection.close()
+
+    def _run_consumer(self, index, connection, channel, counted):
+        """消费线程：连接断开（或消费者被 RabbitMQ 取消）后按指数退避重连，直到 close()"""
+        while True:
+            try:
+                channel.start_consuming()
+                error = "所有消费者已被 RabbitMQ 取消"
+            except Exception as e:
+                error = e
+            self._close_consumer(connection, counted)
+            if self._stopping.is_set():
+                return
+            logger.warning("RabbitMQ 消费者连接断开: %s", error, extra={
+                "event": "consumer.disconnected", "consumer": index,
+            })
+
+            delay = RECONNECT_DELAY
+            while True:
+                if self._stopping.wait(delay):
+                    return
+                try:
+                    consumer = self._open_consumer(index)
+                    break
+                except Exception as e:
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                    logger.warning("RabbitMQ 消费者重连失败，%.0f 秒后重试: %s", delay, e, extra={
+                        "event": "consumer.reconnect_failed", "consumer": index,
+                    })
+            if consumer is None:
+                return
+            connection, channel, counted = consumer
+            if self._stopping.is_set():
+                # close() 可能在连接建立之前执行，没有关闭这个连接
+                self._close_consumer(connection, counted)
+                return
+            logger.info("RabbitMQ 消费者已重连", extra={"event": "consumer.reconnected", "consumer": index})
+
+    def _declare_topology(self, channel):
+        """
+        声明 Exchange、工作队列（分片）、重试和死信队列
+
+        返回 [(队列, handler, 重试队列, batch, 消费该队列的连接序号（None 表示每个连接）, 是否 single active)]
+        """
+        consumers, named_queues = [], []
+        for exchange, handler, queue, shards, batch in self._subscriptions:
+            # 持久化：非持久化的 Exchange 在 RabbitMQ 重启后消失，持久化队列的绑定随之丢失，重新声明前发布的消息被丢弃
+            channel.exchange_declare(exchange=exchange, exchange_type=self.exchange_type, durable=True)
+            if not queue:
+                result = channel.queue_declare(queue='', exclusive=True)
+                channel.queue_bind(exchange=exchange, queue=result.method.queue)
+                consumers.append((result.method.queue, handler, "", batch, 0, False))
+                continue
+            if shards:
+                hash_exchange = f"{queue}.shards"
+                channel.exchange_declare(exchange=hash_exchange, exchange_type="x-consistent-hash", durable=True)
+                channel.exchange_bind(destination=hash_exchange, source=exchange)
+                for shard in range(shards):
+                    shard_queue = f"{queue}.shard-{shard}"
+                    self._declare_retry_topology(channel, shard_queue)
+                    channel.queue_declare(queue=shard_queue, durable=True, arguments={"x-single-active-consumer": True})
+                    # 一致性哈希 Exchange 的绑定键是权重
+                    channel.queue_bind(exchange=hash_exchange, queue=shard_queue, routing_key="1")
+                    named_queues.append(shard_queue)
+                    consumers.append((shard_queue, handler, shard_queue, batch, shard % self.consumer_count, True))
+            else:
+                self._declare_retry_topology(channel, queue)
+                channel.queue_declare(queue=queue, durable=True)
+                channel.queue_bind(exchange=exchange, queue=queue)
+                named_queues.append(queue)
+                consumers.append((queue, handler, queue, batch, None, False))
+        self._named_queues = named_queues
+        return consumers
+
+    def _consume(self, channel, queue_name, handler, retry_queue, batch, single_active, counted):
+        """订阅队列；计入 consumer_workers 的子序列追加到 counted，连接断开时逐个减回"""
+        if batch:
+            # prefetch 至少要容纳一整批，否则 RabbitMQ 不会投递足够的未确认消息
+            channel.basic_qos(prefetch_count=max(self.prefetch, batch[0]))
+            callback = self._make_batch_callback(channel, handler, retry_queue, *batch)
+        else:
+            # prefetch 限制每个消费者持有的未确认消息，积压留在队列中由其他消费者（副本）分担
+            channel.basic_qos(prefetch_count=self.prefetch)
+            callback = self._make_callback(handler, retry_queue)
+        workers = consumer_workers.labels(queue=retry_queue or "exclusive")
+        if single_active:
+            # 备用消费者收不到消息，不计入 consumer_workers（否则饱和度被低估）：收到第一条消息时才计入
+            callback = self._count_when_active(callback, workers, counted)
+        else:
+            workers.inc()
+            counted.append(workers)
+        channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=callback,
+            auto_ack=False  # 手动确认，确保消息处理完成
+        )
+        logger.info("RabbitMQ 消费者已启动", extra={"event": "consumer.started", "queue": queue_name})
+
+    @staticmethod
+    def _count_when_active(callback, workers, counted):
+        # single active consumer 在活跃消费者断开前不会切换，成为活跃消费者后一直计入（直到连接断开）
+        active = False
+
+        def wrapper(ch, method, properties, body):
+            nonlocal active
+            if not active:
+                active = True
+                workers.inc()
+                counted.append(workers)
+            callback(ch, method, properties, body)
+        return wrapper
+
+    @staticmethod
+    def _retry_queue(queue, delay):
+        return f"{queue}.retry.{int(delay * 1000)}ms"
+
+    def _declare_retry_topology(self, channel, queue):
+        channel.exchange_declare(exchange=f"{queue}.dlx", exchange_type="fanout", durable=True)
+        channel.queue_declare(queue=f"{queue}.dlq", durable=True)
+        channel.queue_bind(exchange=f"{queue}.dlx", queue=f"{queue}.dlq")
+        for delay in self.retry_delays():
+            # 延迟写进队列名：修改重试配置会声明新的队列，而不是与已有队列的参数冲突
+            channel.queue_declare(queue=self._retry_queue(queue, delay), durable=True, arguments={
+                "x-message-ttl": int(delay * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            })
+
+    def _settle(self, channel, queue, handler, batched, items):
+        """处理消息并逐条确认；失败的消息先发布到重试队列或死信 Exchange，再确认原消息"""
+        failures = self._process(queue, handler, batched, items)
+        failed_tags = set()
+        for (delivery_tag, body, headers), error in failures:
+            failed_tags.add(delivery_tag)
+            if not queue:
+                # 独占队列没有重试拓扑，保持原来的行为
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+                continue
+            headers, delay = self._failed(queue, headers, error)
+            channel.basic_publish(
+                exchange=f"{queue}.dlx" if delay is None else "",
+                routing_key="" if delay is None else self._retry_queue(queue, delay),
+                body=body,
+                properties=pika.BasicProperties(delivery_mode=2, headers=headers),
+            )
+            channel.basic_ack(delivery_tag=delivery_tag)
+        for delivery_tag, _, _ in items:
+            if delivery_tag not in failed_tags:
+                channel.basic_ack(delivery_tag=delivery_tag)
+
+    def _make_callback(self, handler, queue):
+        def callback(ch, method, properties, body):
+            self._settle(ch, queue, handler, False, [(method.delivery_tag, body, properties.headers or {})])
+        return callback
+
+    def _make_batch_callback(self, channel, handler, queue, batch_size, batch_wait):
+        pending = []
+        timer = None
+
+        def flush():
+            nonlocal timer
+            if timer is not None:
+                channel.connection.remove_timeout(timer)
+                timer = None
+            batch = pending[:]
+            pending.clear()
+            self._settle(channel, queue, handler, True, batch)
+
+        def on_timeout():
+            nonlocal timer
+            timer = None
+            if pending:
+                flush()
+
+        def callback(ch, method, properties, body):
+            nonlocal timer
+            pending.append((method.delivery_tag, body, properties.headers or {}))
+            if len(pending) >= batch_size:
+                flush()
+            elif timer is None:
+                # 定时器在消费线程中触发（BlockingConnection 的事件循环），不需要加锁
+                timer = channel.connection.call_later(batch_wait, on_timeout)
+        return callback
+
+    def _refresh_queue_depths(self):
+        """定期读取工作队列积压和死信队列深度（在第一个消费线程中执行）"""
+        try:
+            for queue in self._named_queues:
+                result = self._depth_channel.queue_declare(queue=queue, passive=True)
+                message_queue_backlog.labels(queue=queue).set(result.method.message_count)
+                message_queue_consumers.labels(queue=queue).set(result.method.consumer_count)
+                result = self._depth_channel.queue_declare(queue=f"{queue}.dlq", passive=True)
+                dead_letter_queue_messages.labels(queue=queue).set(result.method.message_count)
+        except pika.exceptions.AMQPError as e:
+            logger.warning("读取队列深度失败: %s", e, extra={"event": "queue.depth_failed"})
+            return
+        self._depth_channel.connection.call_later(QUEUE_DEPTH_INTERVAL, self._refresh_queue_depths)
+
+    def close(self):
+        self._stopping.set()
+        for connection in list(self._consumer_connections.values()):
+            if not connection.is_closed:
+                # BlockingConnection 不是线程安全的，停止消费需要回到消费线程执行
+                connection.add_callback_threadsafe(connection.close)
+        with self._publish_lock:
+            if self._publish_connection and not self._publish_connection.is_closed:
+                self._publish_connection.close()
+            self._publish_connection = None
+
+
+class InMemoryBroker(MessageBroker):
+    """
+    进程内实现，基于 asyncio.Queue
+
+    同名队列由多个消费者竞争消费，匿名队列每个订阅者一份（fanout）。
+    同步的 handler 在线程池中执行，与 RabbitMQ 消费线程的行为一致。
+    重试通过 loop.call_later 延迟放回队列，死信保存在 dead_letters 中。
+    分片按 routing key 的 CRC32 选择队列，每个分片只有一个消费者。
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._queues = {}
+        self._bindings = {}
+        self._consumers = []
+        self._tasks = []
+        self._loop = None
+        self._users = 0
+        self._names = itertools.count(1)
+        self._delayed = 0
+        self.dead_letters = {}
+
+    def publish(self, exchange, body, headers=None, routing_key=""):
+        item = (None, body, dict(headers or {}))
+        for queue_names in self._bindings.get(exchange, ()):
+            # 与一致性哈希相同的效果：同一个 routing key 总是进入同一个分片
+            queue_name = queue_names[zlib.crc32(routing_key.encode()) % len(queue_names)]
+            self._put(self._queues[queue_name], item)
+
+    def _put(self, queue, item):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            queue.put_nowait(item)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            queue.put_nowait(item)
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def subscribe(self, exchange, handler, queue="", shards=0):
+        if queue and shards:
+            for queue_name in self._bind(exchange, [f"{queue}.shard-{shard}" for shard in range(shards)]):
+                self._add_consumers(queue_name, handler, None, 1)
+        else:
+            (queue_name,) = self._bind(exchange, [queue])
+            self._add_consumers(queue_name, handler, None, self.consumer_count)
+
+    def subscribe_batch(self, exchange, handler, queue="", batch_size=100, batch_wait=0.05):
+        (queue_name,) = self._bind(exchange, [queue])
+        self._add_consumers(queue_name, handler, (batch_size, batch_wait), self.consumer_count)
+
+    def _bind(self, exchange, queue_names):
+        queue_names = [queue or f"amq.gen-{next(self._names)}" for queue in queue_names]
+        if queue_names[0] not in self._queues:
+            for queue_name in queue_names:
+                self._queues[queue_name] = asyncio.Queue()
+                message_queue_backlog.labels(queue=queue_name).set_function(self._queues[queue_name].qsize)
+            self._bindings.setdefault(exchange, []).append(queue_names)
+        return queue_names
+
+    def _add_consumers(self, queue_name, handler, batch, count):
+        for _ in range(count):
+            self._consumers.append((queue_name, handler, batch))
+        message_queue_consumers.labels(queue=queue_name).inc(count)
+        consumer_workers.labels(queue=queue_name).inc(count)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._users += 1
+        # 同一个代理可能被多个服务共享，只启动尚未运行的消费者
+        for queue, handler, batch in self._consumers[len(self._tasks):]:
+            consume = self._consume_batch(queue, handler, *batch) if batch else self._consume(queue, handler)
+            self._tasks.append(self._loop.create_task(consume))
+
+    async def _consume(self, queue_name, handler):
+        queue = self._queues[queue_name]
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            try:
+                await self._settle(loop, queue_name, handler, False, [item])
+            finally:
+                queue.task_done()
+
+    async def _consume_batch(self, queue_name, handler, batch_size, batch_wait):
+        queue = self._queues[queue_name]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + batch_wait
+            while len(batch) < batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._settle(loop, queue_name, handler, True, batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _settle(self, loop, queue_name, handler, batched, items):
+        failures = await loop.run_in_executor(None, self._process, queue_name, handler, batched, items)
+        for (_, body, headers), error in failures:
+            headers, delay = self._failed(queue_name, headers, error)
+            if delay is None:
+                self.dead_letters.setdefault(queue_name, []).append((body, headers))
+                dead_letter_queue_messages.labels(queue=queue_name).set(len(self.dead_letters[queue_name]))
+            else:
+                self._delayed += 1
+                loop.call_later(delay, self._redeliver, queue_name, (None, body, headers))
+
+    def _redeliver(self, queue_name, item):
+        self._delayed -= 1
+        self._queues[queue_name].put_nowait(item)
+
+    async def join(self):
+        """等待所有队列中的消息处理完毕（基准测试使用）"""
+        # 处理一条消息可能向其他队列发布新消息（例如库存结果事件），直到所有队列都为空
+        while True:
+            for queue in list(self._queues.values()):
+                await queue.join()
+            if all(queue.empty() for queue in self._queues.values()):
+                if not self._delayed:
+                    return
+                # 还有等待重投的消息
+                await asyncio.sleep(0.05)
+
+    def close(self):
+        self._users -= 1
+        if self._users > 0:
+            return
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._consumers = []
+
+
+_memory_brokers = {}
+
+
+def create_broker(url, **options):
+    """
+    根据 URL 创建消息代理
+
+    options 传给具体实现（max_attempts、retry_delay）。
+    memory:// 的实例按 URL 在进程内共享，这样同一进程中的
+    order-service 和 product-service 可以通过它交换事件。
+    """
+    if url.startswith("memory://"):
+        if url not in _memory_brokers:
+            _memory_brokers[url] = InMemoryBroker(**options)
+        return _memory_brokers[url]
+    return RabbitMQBroker(url, **options)
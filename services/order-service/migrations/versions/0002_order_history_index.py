@@ -0,0 +1,34 @@
+"""order history index: (user_id, created_at)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 已有数据的表上用 CONCURRENTLY 建索引，不阻塞下单（只能在事务之外执行）
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_orders_user_id_created_at", "orders", ["user_id", "created_at"],
+            postgresql_concurrently=True,
+        )
+        # 组合索引的前缀已经覆盖只按 user_id 的查询
+        op.drop_index("ix_orders_user_id", table_name="orders", postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_orders_user_id", "orders", ["user_id"], postgresql_concurrently=True)
+        op.drop_index("ix_orders_user_id_created_at", table_name="orders", postgresql_concurrently=True)
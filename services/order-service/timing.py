@@ -0,0 +1,72 @@
+"""
+阶段耗时拆解 - 一次请求/消息处理中各阶段的耗时
+
+学习要点：
+1. 统一的标签：service / operation / kind / stage
+   - kind 是固定的几类：db、downstream、broker、serialization
+   - stage 是具体步骤，例如 call_user_service、db.commit
+2. 同一份数据三处可见：Prometheus Histogram、Span Event、Server-Timing 响应头
+3. 不依赖 Trace 采样：每个请求都会记录指标，压测和 Dashboard 都能直接按阶段归因
+4. 每个请求 5~8 个阶段：子序列按 (service, operation, kind, stage) 缓存（bound_metrics.py），不再每次调用 labels()
+
+注意：本文件在 order-service 和 product-service 中保持完全一致。
+"""
+import time
+from contextlib import contextmanager
+
+from opentelemetry import trace
+from prometheus_client import Histogram
+
+from bound_metrics import BoundMetric
+
+DB = "db"
+DOWNSTREAM = "downstream"
+BROKER = "broker"
+SERIALIZATION = "serialization"
+
+stage_duration_seconds = BoundMetric(Histogram(
+    'stage_duration_seconds',
+    'Duration of individual stages within a request or message handler',
+    ['service', 'operation', 'kind', 'stage'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+))
+
+
+class StageTimer:
+    """
+    记录一次操作（如 create_order）中各阶段的耗时
+
+    用法：
+        timer = StageTimer("order-service", "create_order")
+        with timer.stage(DOWNSTREAM, "call_user_service"):
+            ...
+        response.headers["Server-Timing"] = timer.server_timing()
+    """
+
+    def __init__(self, service, operation, span=None):
+        self.service = service
+        self.operation = operation
+        self.span = span or trace.get_current_span()
+        self.timings = []
+
+    @contextmanager
+    def stage(self, kind, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self.timings.append((name, duration))
+            stage_duration_seconds.labels(self.service, self.operation, kind, name).observe(duration)
+            self.span.add_event(f"stage.{name}", {
+                "stage.kind": kind,
+                "stage.duration_ms": round(duration * 1000, 3),
+            })
+
+    def server_timing(self):
+        """
+        生成 Server-Timing 响应头，例如 call_user_service;dur=12.3, db.commit;dur=1.8
+
+        浏览器开发者工具和压测工具可以直接展示各阶段耗时
+        """
+        return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, duration in self.timings)
@@ -0,0 +1,172 @@
+"""
+结构化日志 - JSON 输出、后台线程写出、按消息类型采样
+
+学习要点：
+1. print() 在调用线程中同步写 stdout：日志收集器读得慢、管道写满时，事件循环 / 消费者线程一起阻塞
+2. QueueHandler + QueueListener：调用方只把记录放进内存队列，后台线程格式化并写出
+   - 队列有界（LOG_QUEUE_SIZE，默认 10000）：写满时丢弃并计数，不阻塞调用方
+3. 每条日志一行 JSON：Loki / Elasticsearch 直接按字段检索（event、order_id ...），不需要正则
+4. trace_id / span_id 取自当前 OpenTelemetry Span：从日志跳到 Jaeger 中的完整调用链
+   - 必须在调用线程中读取（Span 上下文绑定在线程 / Task 上），所以在 Filter 中注入，而不是在后台线程格式化时
+5. 按消息类型采样：日志通过 extra={"event": "order.published"} 标明类型
+   - LOG_SAMPLE_RATES="order.published=0.01,stock.deducted=0.1"：每条消息一条的高频日志只保留一部分
+   - WARNING 及以上从不采样；保留下来的记录带 sample_rate，统计时可按比例还原
+6. 日志量指标：log_records_total{service, level, event, outcome="emitted|sampled|dropped"}
+
+用法：
+    logger = setup_logging("order-service")
+    logger.info("订单创建事件已发布", extra={"event": "order.published", "order_id": 42})
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge
+
+from bound_metrics import BoundMetric
+
+log_records_total = BoundMetric(Counter(
+    'log_records_total',
+    'Log records by outcome (emitted, sampled out, dropped because the queue was full)',
+    ['service', 'level', 'event', 'outcome']
+))
+
+log_queue_size = Gauge(
+    'log_queue_size',
+    'Log records waiting for the writer thread',
+    ['service']
+)
+
+# LogRecord 自带的属性，其余属性来自 extra，作为 JSON 字段输出（uvicorn 的 color_message 是带终端颜色的重复消息）
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+# 由 Filter 注入、单独输出的字段
+_INJECTED = {"service", "event", "trace_id", "span_id", "sample_rate"}
+
+_listener = None
+# 调用过 setup_logging 的服务：同名 logger 的记录归属该服务
+_services = set()
+
+
+def parse_sample_rates(value):
+    """ "order.published=0.01,stock.deducted=0.1" -> {"order.published": 0.01, "stock.deducted": 0.1} """
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中采样、注入 service / trace_id / span_id，并记录日志量"""
+
+    def __init__(self, service, sample_rates):
+        super().__init__()
+        self.service = service
+        self.sample_rates = sample_rates
+
+    def filter(self, record):
+        service = getattr(record, "service", None) or (record.name if record.name in _services else self.service)
+        event = getattr(record, "event", "none")
+        rate = 1.0 if record.levelno >= logging.WARNING else self.sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            log_records_total.labels(service, record.levelname, event, "sampled").inc()
+            return False
+
+        record.service = service
+        record.event = event
+        if rate < 1.0:
+            record.sample_rate = rate
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = format(context.trace_id, "032x")
+            record.span_id = format(context.span_id, "016x")
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """队列满时丢弃记录，不阻塞、也不向 stderr 输出错误"""
+
+    def prepare(self, record):
+        # 消息和异常堆栈在调用线程中格式化（args、traceback 不能跨线程保留），其余字段原样交给 JSON 格式化
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_total.labels(record.service, record.levelname, record.event, "dropped").inc()
+            return
+        log_records_total.labels(record.service, record.levelname, record.event, "emitted").inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": getattr(record, "service", None),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage(),
+        }
+        for key in ("trace_id", "span_id", "sample_rate"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key not in _INJECTED:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(service):
+    """
+    配置根 logger：JSON、后台线程写 stdout、按 LOG_SAMPLE_RATES 采样，返回该服务的 logger
+
+    同一进程中多次调用（scripts/local_stack.py 在一个进程中运行三个服务）只配置一次，
+    各服务通过返回的 logger（名称即服务名）或 extra={"service": ...} 区分
+    """
+    global _listener
+    _services.add(service)
+    if _listener is not None:
+        return logging.getLogger(service)
+
+    records = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    log_queue_size.labels(service=service).set_function(records.qsize)
+
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(ContextFilter(service, parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(handler)
+    # httpx 每个请求一条 INFO：服务间调用已经有追踪和 service_calls_total，不再重复记录
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(records, writer)
+    _listener.start()
+    # 进程退出前写完队列中剩余的记录
+    atexit.register(_listener.stop)
+    return logging.getLogger(service)
@@ -0,0 +1,54 @@
+"""baseline: products and reservations tables as created by create_all before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 引入迁移之前表由服务启动时的 create_all 创建：已存在时直接接管，不需要手工 stamp
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("products"):
+        op.create_table(
+            "products",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.String(), nullable=True),
+            sa.Column("description", sa.String(), nullable=True),
+            sa.Column("price", sa.Float(), nullable=True),
+            sa.Column("stock", sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_products_id", "products", ["id"])
+        op.create_index("ix_products_name", "products", ["name"])
+    if not inspector.has_table("reservations"):
+        op.create_table(
+            "reservations",
+            sa.Column("token", sa.String(), nullable=False),
+            sa.Column("product_id", sa.Integer(), nullable=True),
+            sa.Column("quantity", sa.Integer(), nullable=True),
+            sa.Column("status", sa.String(), nullable=True),
+            sa.Column("order_id", sa.Integer(), nullable=True),
+            sa.Column("expires_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("token"),
+        )
+        op.create_index("ix_reservations_product_id", "reservations", ["product_id"])
+        op.create_index("ix_reservations_status", "reservations", ["status"])
+        op.create_index("ix_reservations_expires_at", "reservations", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("reservations")
+    op.drop_table("products")
@@ -0,0 +1,37 @@
+"""reservation expiry index: (status, expires_at)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 已有数据的表上用 CONCURRENTLY 建索引，不阻塞预留（只能在事务之外执行）
+    with op.get_context().autocommit_block():
+        # 过期清理的条件是 status = 'reserved' AND expires_at <= now：
+        # 单独的 status 索引要读出所有 reserved 行，单独的 expires_at 索引要读出所有已过期的历史预留
+        op.create_index(
+            "ix_reservations_status_expires_at", "reservations", ["status", "expires_at"],
+            postgresql_concurrently=True,
+        )
+        op.drop_index("ix_reservations_status", table_name="reservations", postgresql_concurrently=True)
+        op.drop_index("ix_reservations_expires_at", table_name="reservations", postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_reservations_status", "reservations", ["status"], postgresql_concurrently=True)
+        op.create_index("ix_reservations_expires_at", "reservations", ["expires_at"], postgresql_concurrently=True)
+        op.drop_index("ix_reservations_status_expires_at", table_name="reservations", postgresql_concurrently=True)
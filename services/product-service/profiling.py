@@ -0,0 +1,219 @@
+"""
+按需性能分析 - 生产 Pod 的 CPU 采样和事件循环诊断
+
+学习要点：
+1. 采样式 Profiler（与 py-spy 相同的思路）：后台线程定期读取所有线程的调用栈
+   - 只在请求 /admin/profile 时运行，空闲时没有任何开销
+   - 不需要额外依赖，也不需要 SYS_PTRACE 权限
+   - 输出 speedscope 文件（https://www.speedscope.app）或折叠栈（flamegraph.pl）
+2. 事件循环延迟（event loop lag）：定时任务实际被调度的时间减去预期时间
+   - 异步处理函数中的阻塞调用（同步数据库、同步 HTTP）会直接表现为延迟升高
+3. 管理端点需要 ADMIN_TOKEN，未配置时端点不可用
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import asyncio
+import hmac
+import sys
+import threading
+import time
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from prometheus_client import Gauge
+
+event_loop_lag_seconds = Gauge(
+    'event_loop_lag_seconds',
+    'Delay between when a periodic event loop callback was due and when it ran',
+    ['service']
+)
+
+MAX_PROFILE_SECONDS = 60
+
+# 线程空闲时停留的函数：采样时默认丢弃这些样本，只看真正消耗 CPU 的栈
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+
+class LoopLagMonitor:
+    """定期测量事件循环延迟并写入 event_loop_lag_seconds"""
+
+    def __init__(self, service, interval=0.5):
+        self.service = service
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._gauge = event_loop_lag_seconds.labels(service=service)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._gauge.set(lag)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+def sample_stacks(seconds, interval, include_idle=False):
+    """
+    在调用线程中采样所有其他线程的调用栈
+
+    返回 {线程名: [栈（从根到叶的 (name, file, line) 元组）, ...]}
+    """
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    samples = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            if not include_idle and _is_idle(stack):
+                continue
+            samples.setdefault(names.get(ident, str(ident)), []).append(stack)
+        time.sleep(interval)
+    return samples
+
+
+def _is_idle(stack):
+    name, filename, _ = stack[-1]
+    return (filename.rsplit("/", 1)[-1], name) in _IDLE_FRAMES
+
+
+def to_speedscope(samples, interval, title):
+    """转换为 speedscope 的 sampled 格式，每个线程一个 profile"""
+    frames = []
+    index = {}
+    profiles = []
+    for thread_name, stacks in samples.items():
+        encoded = []
+        for stack in stacks:
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            encoded.append(ids)
+        profiles.append({
+            "type": "sampled",
+            "name": thread_name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": len(encoded) * interval,
+            "samples": encoded,
+            "weights": [interval] * len(encoded),
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": title,
+        "exporter": "profiling.py",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
+
+
+def to_collapsed(samples):
+    """转换为折叠栈格式（thread;func;func count），可用 flamegraph.pl 或 speedscope 打开"""
+    counts = {}
+    for thread_name, stacks in samples.items():
+        for stack in stacks:
+            key = ";".join([thread_name] + [f"{name} ({filename.rsplit('/', 1)[-1]}:{line})"
+                                            for name, filename, line in stack])
+            counts[key] = counts.get(key, 0) + 1
+    return "\n".join(f"{key} {count}" for key, count in sorted(counts.items())) + "\n"
+
+
+def dump_tasks(limit=5):
+    """当前事件循环中所有任务及其调用栈"""
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "stack": [
+                f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})"
+                for frame in task.get_stack(limit=limit)
+            ],
+        })
+    return tasks
+
+
+def create_admin_router(service, admin_token, loop_lag):
+    """
+    管理端点：/admin/profile（CPU 采样）和 /admin/tasks（事件循环诊断）
+
+    admin_token 为空时所有管理端点返回 404
+    """
+    router = APIRouter(prefix="/admin", include_in_schema=False)
+    profile_lock = asyncio.Lock()
+
+    def check_token(token):
+        if not admin_token:
+            raise HTTPException(status_code=404, detail="Not Found")
+        # compare_digest 只接受 ASCII 的 str：按 UTF-8 编码后比较，非 ASCII 的请求头返回 403 而不是 500
+        if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+    @router.get("/profile")
+    async def profile(
+        seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+        interval_ms: float = Query(5.0, ge=1, le=1000),
+        format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+        idle: bool = False,
+        x_admin_token: str = Header(None),
+    ):
+        check_token(x_admin_token)
+        # 同一时间只允许一个采样，避免多个采样线程叠加开销
+        if profile_lock.locked():
+            raise HTTPException(status_code=409, detail="Profile already in progress")
+        async with profile_lock:
+            interval = interval_ms / 1000
+            # 在线程中采样，事件循环照常处理请求（被采样的正是它）
+            samples = await asyncio.to_thread(sample_stacks, seconds, interval, idle)
+
+        filename = f"{service}-{int(time.time())}"
+        if format == "collapsed":
+            return PlainTextResponse(
+                to_collapsed(samples),
+                headers={"Content-Disposition": f'attachment; filename="{filename}.folded"'}
+            )
+        return JSONResponse(
+            to_speedscope(samples, interval, f"{service} ({seconds:g}s)"),
+            headers={"Content-Disposition": f'attachment; filename="{filename}.speedscope.json"'}
+        )
+
+    @router.get("/tasks")
+    async def tasks(limit: int = Query(5, ge=1, le=50), x_admin_token: str = Header(None)):
+        check_token(x_admin_token)
+        return {
+            "service": service,
+            "event_loop_lag_seconds": {"last": loop_lag.last_lag, "max": loop_lag.max_lag},
+            "threads": [thread.name for thread in threading.enumerate()],
+            "tasks": dump_tasks(limit),
+        }
+
+    return router
@@ -0,0 +1,63 @@
+"""
+请求合并（single-flight）- 同一个 key 的并发读取只执行一次
+
+学习要点：
+1. 秒杀时成百上千个请求同时读取同一个商品 / 用户，每个请求都发出相同的查询（惊群）
+2. 第一个调用者（leader）执行读取，读取期间到达的调用者（follower）等待同一个结果
+3. 不是缓存：读取完成后立即删除，之后的调用重新读取，不会返回过期数据
+   - 写入方知道数据已变化时调用 forget(key)，之后的调用不再加入写入前开始的读取
+4. 读取在独立的 Task 中执行：leader 的请求被取消（客户端断开）不会让 follower 一起失败
+5. 合并比例 = follower / 全部调用，导出为 singleflight_calls_total{role}
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import asyncio
+
+from opentelemetry import trace
+from prometheus_client import Counter
+
+singleflight_calls_total = Counter(
+    'singleflight_calls_total',
+    'Calls through a single-flight group (coalescing ratio = follower / all)',
+    ['service', 'group', 'role']
+)
+
+
+class SingleFlight:
+    """
+    按 key 合并并发的异步读取
+
+    用法：
+        product_reads = SingleFlight("product-service", "get_product")
+        product = await product_reads.do(product_id, asyncio.to_thread, load_product, product_id)
+    """
+
+    def __init__(self, service, group):
+        self._calls = {}
+        self._leader = singleflight_calls_total.labels(service=service, group=group, role="leader")
+        self._follower = singleflight_calls_total.labels(service=service, group=group, role="follower")
+
+    async def do(self, key, fn, *args):
+        """执行 fn(*args)（返回 awaitable），同一 key 已有读取在进行时等待它的结果"""
+        task = self._calls.get(key)
+        if task is None:
+            self._leader.inc()
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self._follower.inc()
+            trace.get_current_span().set_attribute("singleflight.shared", True)
+        # shield：某个调用者被取消时，读取本身继续，其他调用者照常拿到结果
+        return await asyncio.shield(task)
+
+    def forget(self, key):
+        """数据已变化：之后的调用发起新的读取，不再等待进行中的旧读取"""
+        self._calls.pop(key, None)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有调用者都已取消时，没有人读取异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,102 @@
+"""
+预绑定的指标子序列 - 热路径上的 Prometheus 计数不再查找 label
+
+学习要点：
+1. counter.labels(method=..., endpoint=..., status=...) 每次调用都要校验、排序 label 名，
+   构造元组，并获取指标级别的锁查找子序列；子序列的 inc() 再获取一次子序列的锁
+2. BoundMetric 在导入时为已知的路由 / 状态创建子序列并缓存，热路径上只剩一次字典查找
+   - 未预绑定的组合（如下游返回的意外状态码）第一次出现时创建并缓存，基数与之前相同
+3. 可选的线程本地累加（METRICS_THREAD_LOCAL=true，只对 Counter 生效）
+   - inc() 只写当前线程自己的累加值：不加锁，事件循环和消费者线程之间没有锁竞争
+   - 抓取 /metrics 时 flush() 把各线程累加值的增量一次性写入真正的 Counter
+   - 代价：两次抓取之间 Counter 的值不更新，进程内直接读取 REGISTRY 前要先 flush()
+4. Histogram / Gauge 只缓存子序列（observe 需要分桶，set 需要立即可见）
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import os
+import threading
+
+from prometheus_client import Counter
+
+THREAD_LOCAL = os.getenv("METRICS_THREAD_LOCAL", "false").lower() == "true"
+
+# 线程本地模式下创建的全部子序列，flush() 时逐个写入
+_local_children = []
+_local_children_lock = threading.Lock()
+
+
+class BoundMetric:
+    """
+    按 label 值（位置参数，顺序与定义指标时的 labelnames 相同）缓存子序列
+
+    用法：
+        requests = BoundMetric(order_service_http_requests_total, [
+            ("POST", "/api/orders", "200"),
+            ("POST", "/api/orders", "500"),
+        ])
+        requests.labels("POST", "/api/orders", "200").inc()
+    """
+
+    def __init__(self, metric, known=(), thread_local=None):
+        self._metric = metric
+        # thread_local=None 时由 METRICS_THREAD_LOCAL 决定（基准测试可以显式指定）
+        self._local = (THREAD_LOCAL if thread_local is None else thread_local) and isinstance(metric, Counter)
+        self._children = {}
+        self._lock = threading.Lock()
+        for values in known:
+            self.labels(*values)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._metric.labels(*values)
+                    if self._local:
+                        child = ThreadLocalCounter(child)
+                    self._children[values] = child
+        return child
+
+
+class ThreadLocalCounter:
+    """Counter 子序列的线程本地累加，flush() 时写入"""
+
+    def __init__(self, child):
+        self._child = child
+        self._local = threading.local()
+        # 每个线程的累加值（threading.local 的 __dict__）：线程结束后仍保留，计数不会丢失
+        self._threads = []
+        self._flushed = 0.0
+        self._lock = threading.Lock()
+        with _local_children_lock:
+            _local_children.append(self)
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented by non-negative amounts.')
+        local = self._local
+        try:
+            # 只有当前线程写自己的累加值，不需要加锁
+            local.total += amount
+        except AttributeError:
+            local.total = amount
+            with self._lock:
+                self._threads.append(local.__dict__)
+
+    def flush(self):
+        with self._lock:
+            # 各线程的累加值只增不减：读到的旧值只会让增量推迟到下一次 flush
+            total = sum(values.get("total", 0) for values in self._threads)
+            if total > self._flushed:
+                self._child.inc(total - self._flushed)
+                self._flushed = total
+
+
+def flush():
+    """把线程本地累加的计数写入 Counter（抓取 /metrics 前调用；未开启时什么也不做）"""
+    with _local_children_lock:
+        children = list(_local_children)
+    for child in children:
+        child.flush()
@@ -0,0 +1,84 @@
+"""
+数据库连接管理 - 按配置延迟创建 Engine
+
+学习要点：
+1. 延迟创建：导入模块时不连接数据库，第一次使用时才创建 Engine
+2. 通过 DATABASE_URL 选择数据库：postgresql:// 用于部署，sqlite:// 用于本地运行和基准测试
+3. 每个服务持有自己的 Database 实例，多个服务可以在同一进程中共存
+4. PostgreSQL 的表结构由 Alembic 迁移管理（migrations/），在部署时执行，不在服务启动时修改表结构
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import atexit
+import os
+import tempfile
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+
+def create_database_engine(url):
+    """根据 URL 创建 Engine，并自动检测 SQLAlchemy"""
+    # 在这里导入：instrumentation 包导入较慢，不应计入服务的冷启动时间
+    from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+
+    if url.startswith("sqlite"):
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            # 内存数据库只存在于单个连接中：所有会话共享一个连接时，线程池和消费者线程中
+            # 并发的会话会提交 / 回滚彼此的事务。改用进程退出时删除的临时文件，每个会话独立连接
+            fd, path = tempfile.mkstemp(prefix="sqlite-", suffix=".db")
+            os.close(fd)
+            atexit.register(os.remove, path)
+            url = f"sqlite:///{path}"
+        # SQLite 连接默认只能在创建它的线程使用，而消费者运行在独立线程；
+        # 打开 SQLite 文件几乎没有开销，不使用连接池，避免高并发压测时连接池耗尽阻塞事件循环
+        engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=NullPool)
+    else:
+        # pool_pre_ping=True: 连接前检查连接是否有效，避免使用已断开的连接
+        engine = create_engine(url, pool_pre_ping=True)
+    SQLAlchemyInstrumentor().instrument(engine=engine)
+    return engine
+
+
+class Database:
+    """延迟创建 Engine 的数据库句柄"""
+
+    def __init__(self, url):
+        self.url = url
+        self._engine = None
+        self._lock = threading.Lock()
+        self._sessionmaker = sessionmaker(autocommit=False, autoflush=False)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    engine = create_database_engine(self.url)
+                    self._sessionmaker.configure(bind=engine)
+                    self._engine = engine
+        return self._engine
+
+    def session(self):
+        """创建新的数据库会话"""
+        self.engine
+        return self._sessionmaker()
+
+    def prepare(self, metadata):
+        """
+        启动时准备数据库
+
+        SQLite（本地运行、压测）直接按模型建表；PostgreSQL 只检查连接，
+        表结构由部署前的 alembic upgrade head 创建（多个副本同时启动时不会竞争修改表结构）
+        """
+        if self.url.startswith("sqlite"):
+            metadata.create_all(bind=self.engine)
+        else:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
@@ -0,0 +1,51 @@
+"""
+Alembic 迁移环境
+
+学习要点：
+1. 迁移在部署时单独执行（Kubernetes Job / Helm pre-upgrade hook），不在服务启动时执行
+   - 多个副本同时启动时不会竞争修改表结构，启动也不会被长时间的建索引阻塞
+2. 数据库地址与服务使用同一个 DATABASE_URL
+3. target_metadata 来自 main.py 的模型：alembic check 可以发现模型和迁移不一致
+
+注意：本文件在所有服务中保持完全一致。
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+# 导入 main.py 不会连接数据库，也不会启动后台任务（见 startup.py）
+from main import Base, database_url
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """生成 SQL 脚本而不连接数据库：alembic upgrade head --sql"""
+    context.configure(url=database_url, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    engine = create_engine(database_url, poolclass=NullPool)
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite 不支持大部分 ALTER TABLE，用重建表的方式执行
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,43 @@
+"""case-insensitive unique email: unique index on lower(email)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 之前只区分大小写唯一，可能已经存在只有大小写不同的邮箱：先报告，需要人工合并
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT lower(email) FROM users WHERE email IS NOT NULL "
+        "GROUP BY lower(email) HAVING count(*) > 1 LIMIT 10"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"users.email has case-insensitive duplicates, merge them first: {duplicates}")
+
+    # 已有数据的表上用 CONCURRENTLY 建索引，不阻塞注册（只能在事务之外执行）
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_email_lower", "users", [sa.text("lower(email)")], unique=True,
+            postgresql_concurrently=True,
+        )
+        # lower(email) 唯一已经保证 email 唯一
+        op.drop_index("ix_users_email", table_name="users", postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_users_email", "users", ["email"], unique=True, postgresql_concurrently=True)
+        op.drop_index("ix_users_email_lower", table_name="users", postgresql_concurrently=True)
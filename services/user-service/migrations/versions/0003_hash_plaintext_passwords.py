@@ -0,0 +1,50 @@
+"""hash plaintext passwords with Argon2id
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 11:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from passwords import hasher_from_env
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 500
+
+
+def upgrade() -> None:
+    # 之前的版本明文保存密码：用与服务相同的参数（PASSWORD_HASH_*）哈希已有的明文
+    # 按 id 分批读取，不把整张表读进内存
+    hasher = hasher_from_env()
+    bind = op.get_bind()
+    # 每次哈希几十毫秒 CPU，大表在迁移 Job 的 CPU 限制和 activeDeadlineSeconds 内可能完不成：
+    # 在事务之外执行，每批写入后立即提交，Job 超时后重新执行时只处理剩下的明文（已哈希的以 $argon2 开头）
+    with op.get_context().autocommit_block():
+        last_id = 0
+        while True:
+            rows = bind.execute(sa.text(
+                "SELECT id, password FROM users WHERE id > :last_id AND password IS NOT NULL "
+                "AND password NOT LIKE '$argon2%' ORDER BY id LIMIT :batch"
+            ), {"last_id": last_id, "batch": BATCH}).all()
+            if not rows:
+                break
+            bind.execute(
+                sa.text("UPDATE users SET password = :password WHERE id = :id"),
+                [{"id": row.id, "password": hasher.hash(row.password)} for row in rows],
+            )
+            last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    # 哈希不可逆，降级后继续保存哈希（旧版本无法用它们登录，但也没有登录接口）
+    pass
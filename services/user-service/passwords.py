@@ -0,0 +1,97 @@
+"""
+密码哈希 - Argon2id，在有界线程池中计算，不阻塞事件循环
+
+学习要点：
+1. 密码不能明文存储，也不能用 sha256 这类快速哈希：Argon2id 故意又慢又占内存，离线暴力破解代价很高
+2. 一次哈希需要几十毫秒 CPU：在事件循环中直接计算，这段时间内该进程的所有请求（包括 /health）都会停顿
+3. argon2-cffi 计算时释放 GIL：线程池就能多核并行，不需要进程池（不用序列化参数，也不用多一份进程内存）
+4. 线程池有界（PASSWORD_HASH_WORKERS，默认等于可用 CPU 数）
+   - 同时计算的哈希数不超过核数，内存上限 = workers × PASSWORD_HASH_MEMORY_KIB
+   - 注册高峰时多出来的请求在 asyncio 中排队（password_hash_in_flight 上升），不会创建更多线程
+5. 独立的线程池：不占用 asyncio.to_thread 的默认线程池，注册高峰不影响查询用户
+6. 成本参数可配置（PASSWORD_HASH_*），服务和迁移 0003 使用同一组参数
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+from opentelemetry import trace
+from prometheus_client import Gauge, Histogram
+
+tracer = trace.get_tracer(__name__)
+
+password_hash_seconds = Histogram(
+    'password_hash_seconds',
+    'CPU time of one password hash in the worker pool',
+    ['service', 'operation'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+password_hash_in_flight = Gauge(
+    'password_hash_in_flight',
+    'Password hashes queued or running in the worker pool',
+    ['service']
+)
+
+
+def available_cpus():
+    """进程可用的 CPU 数（容器中 os.cpu_count() 返回的是宿主机核数）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def hasher_from_env():
+    """
+    按环境变量创建 PasswordHasher，默认值是 OWASP 推荐的 Argon2id 最低参数
+
+    PASSWORD_HASH_TIME_COST    迭代次数（默认 2）
+    PASSWORD_HASH_MEMORY_KIB   每次哈希使用的内存（默认 19456，即 19 MiB）
+    PASSWORD_HASH_PARALLELISM  单次哈希的并行度（默认 1：并行度由线程池提供）
+    """
+    return PasswordHasher(
+        time_cost=int(os.getenv("PASSWORD_HASH_TIME_COST", "2")),
+        memory_cost=int(os.getenv("PASSWORD_HASH_MEMORY_KIB", "19456")),
+        parallelism=int(os.getenv("PASSWORD_HASH_PARALLELISM", "1")),
+    )
+
+
+class PasswordHashing:
+    """
+    在专用线程池中计算密码哈希
+
+    用法：
+        passwords = PasswordHashing("user-service")
+        password_hash = await passwords.hash(password)
+    """
+
+    def __init__(self, service, workers=None, hasher=None):
+        self.workers = workers or int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or available_cpus()
+        self._hasher = hasher or hasher_from_env()
+        # 线程在第一次提交任务时才创建，导入模块不会增加冷启动耗时
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._service = service
+        self._in_flight = password_hash_in_flight.labels(service=service)
+
+    async def hash(self, password):
+        return await self._run("hash", self._hasher.hash, password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, operation, fn, *args):
+        with tracer.start_as_current_span(f"password_{operation}"), self._in_flight.track_inprogress():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, operation, fn, *args)
+
+    def _timed(self, operation, fn, *args):
+        # 只统计计算耗时，排队时间由 password_hash_in_flight 反映
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            password_hash_seconds.labels(service=self._service, operation=operation).observe(
+                time.perf_counter() - started
+            )
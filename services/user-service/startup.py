@@ -0,0 +1,127 @@
+"""
+启动管理 - 延迟、并行初始化外部资源
+
+学习要点：
+1. 导入 main.py 时不连接数据库、不创建 Exporter，冷启动只付出导入成本
+2. lifespan 中把初始化步骤放到后台并行执行，应用立即可以响应 /health
+3. 必需步骤全部完成后 /ready 才返回 200（Kubernetes Readiness Probe）
+4. 失败的步骤按指数退避重试，而不是打印一行日志后放弃
+5. 导入耗时和就绪耗时导出为 Prometheus 指标，冷启动优化可以量化
+
+注意：本文件在所有服务中保持完全一致。
+"""
+import asyncio
+import logging
+import time
+
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class Step:
+    """一个初始化步骤，func 可以是同步函数（在线程中执行）或协程函数"""
+
+    def __init__(self, name, func, required=True):
+        self.name = name
+        self.func = func
+        # 非必需步骤（如消息消费者）不阻塞就绪，失败后在后台持续重试
+        self.required = required
+        self.done = False
+        self.error = None
+
+
+class Startup:
+    """
+    记录服务的启动过程
+
+    在 main.py 最开始创建，这样 import_seconds 包含所有模块导入的耗时。
+    """
+
+    def __init__(self, service, retry_initial=0.5, retry_max=30.0):
+        self.service = service
+        self.started = time.perf_counter()
+        self.import_seconds = None
+        self.ready_seconds = None
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.steps = []
+        self._tasks = []
+        self._ready = None
+
+        prefix = service.replace("-", "_")
+        self._import_gauge = Gauge(
+            f'{prefix}_startup_import_seconds',
+            f'Time spent importing {service} modules'
+        )
+        self._ready_gauge = Gauge(
+            f'{prefix}_startup_ready_seconds',
+            f'Time from process import to {service} readiness'
+        )
+
+    def imported(self):
+        """main.py 导入完成时调用"""
+        self.import_seconds = time.perf_counter() - self.started
+        self._import_gauge.set(self.import_seconds)
+
+    def begin(self, *steps):
+        """在 lifespan 中调用：后台并行执行所有步骤，立即返回"""
+        self.steps = list(steps)
+        self._ready = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(step)) for step in self.steps]
+        self._tasks.append(asyncio.create_task(self._wait_required()))
+
+    async def _run(self, step):
+        delay = self.retry_initial
+        while True:
+            try:
+                if asyncio.iscoroutinefunction(step.func):
+                    await step.func()
+                else:
+                    # 同步步骤（建表、连接 RabbitMQ）在线程中执行，多个步骤可以并行
+                    await asyncio.to_thread(step.func)
+                step.done = True
+                step.error = None
+                return
+            except Exception as e:
+                step.error = str(e)
+                logger.warning("%s 初始化步骤 %s 失败，%.1fs 后重试: %s", self.service, step.name, delay, e, extra={
+                    "event": "startup.step_failed", "service": self.service, "step": step.name,
+                })
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+
+    async def _wait_required(self):
+        required = [task for task, step in zip(self._tasks, self.steps) if step.required]
+        await asyncio.gather(*required)
+        self.ready_seconds = time.perf_counter() - self.started
+        self._ready_gauge.set(self.ready_seconds)
+        self._ready.set()
+        logger.info("%s 已就绪: 导入 %.3fs, 就绪 %.3fs", self.service, self.import_seconds, self.ready_seconds, extra={
+            "event": "startup.ready", "service": self.service,
+            "import_seconds": self.import_seconds, "ready_seconds": self.ready_seconds,
+        })
+
+    @property
+    def ready(self):
+        return self._ready is not None and self._ready.is_set()
+
+    async def wait(self):
+        """等待所有必需步骤完成"""
+        await self._ready.wait()
+
+    def status(self):
+        """/ready 端点的响应内容"""
+        return {
+            "service": self.service,
+            "ready": self.ready,
+            "steps": {
+                step.name: "done" if step.done else (f"retrying: {step.error}" if step.error else "pending")
+                for step in self.steps
+            },
+        }
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)